@@ -1,25 +1,37 @@
-import requests
-from bs4 import BeautifulSoup
+import asyncio
+import httpx
+from cssselect import HTMLTranslator, parse as css_parse
+from cssselect.parser import CombinedSelector
+from lxml import etree
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.common.exceptions import InvalidSessionIdException, TimeoutException, WebDriverException
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
 import sqlite3
-import pandas as pd
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import schedule
 import time
 import argparse
+import atexit
+import functools
 import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from dotenv import load_dotenv
 
+try:
+    import uvloop  # Optional faster event loop (Linux/macOS)
+except ImportError:
+    uvloop = None
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -37,134 +49,411 @@ HEADERS = {
     'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
     'Connection': 'keep-alive'
 }
+MOBILE_HEADERS = {
+    **HEADERS,
+    'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1'
+}
+# Headless Chrome instances kept alive for the Selenium fallback. With a
+# Selenium Grid, match this to the number of Chrome nodes.
+MAX_BROWSERS = int(os.getenv('MAX_BROWSERS', 4))
+SELENIUM_GRID_URL = os.getenv('SELENIUM_GRID_URL')
+PRICE_CACHE_TTL = 300  # Seconds a scraped price is reused by back-to-back checks
 
 # --- Database Functions ---
 
+_conn = None
+
+# SQL lives in static strings with ? placeholders, so sqlite3's statement
+# cache reuses each compiled statement across calls and scheduled runs.
+_INSERT_PRODUCT_STMT = "INSERT INTO products (url, name, threshold) VALUES (?, ?, ?)"
+_INSERT_PRICE_STMT = "INSERT INTO price_history (product_id, price) VALUES (?, ?)"
+_UPDATE_VALIDATORS_STMT = "UPDATE products SET etag = ?, last_modified = ? WHERE id = ?"
+_SELECT_PRODUCTS_STMT = "SELECT id, url, name, threshold, etag, last_modified FROM products"
+_SELECT_LATEST_PRICES_STMT = """SELECT product_id, price FROM (
+                                    SELECT product_id, price,
+                                           ROW_NUMBER() OVER (PARTITION BY product_id ORDER BY timestamp DESC, id DESC) AS rn
+                                    FROM price_history)
+                                WHERE rn = 1"""
+_SELECT_HISTORY_STMT = "SELECT product_id, price, timestamp FROM price_history ORDER BY product_id, timestamp, id"
+# Columns added after the first release, for upgrading existing databases
+_ADD_COLUMN_STMTS = {
+    'etag': "ALTER TABLE products ADD COLUMN etag TEXT",
+    'last_modified': "ALTER TABLE products ADD COLUMN last_modified TEXT",
+}
+
+def get_conn():
+    """
+    Returns the shared SQLite connection, opening it on first use.
+    check_same_thread=False lets the scheduler thread reuse the same handle.
+    """
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(DATABASE, check_same_thread=False)
+        _conn.row_factory = sqlite3.Row  # Rows are tuples that also allow product['name']
+    return _conn
+
 def setup_database():
     """Initializes the SQLite database and creates tables if they don't exist."""
-    with sqlite3.connect(DATABASE) as conn:
+    conn = get_conn()
+    # WAL lets the report read while a check is writing, and NORMAL sync only
+    # fsyncs at checkpoints instead of on every commit.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-20000")  # ~20 MB page cache
+    conn.execute("PRAGMA mmap_size=134217728")  # Map up to 128 MB of the file
+    with conn:
         c = conn.cursor()
         c.execute('''CREATE TABLE IF NOT EXISTS products
                      (id INTEGER PRIMARY KEY, 
                      url TEXT UNIQUE, 
                      name TEXT,
-                     threshold REAL)''')
+                     threshold REAL,
+                     etag TEXT,
+                     last_modified TEXT)''')
+        # Databases created before conditional GET support lack the validator columns
+        columns = {row[1] for row in c.execute("PRAGMA table_info(products)")}
+        for column, statement in _ADD_COLUMN_STMTS.items():
+            if column not in columns:
+                c.execute(statement)
         c.execute('''CREATE TABLE IF NOT EXISTS price_history
                      (id INTEGER PRIMARY KEY,
                      product_id INTEGER,
                      price REAL,
                      timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
                      FOREIGN KEY(product_id) REFERENCES products(id))''')
-        conn.commit()
+        # Serves the latest-prices-per-product lookup without a sort. It has to
+        # carry the id tiebreak too, so it replaces the (product_id, timestamp)
+        # index earlier versions created.
+        c.execute("DROP INDEX IF EXISTS idx_price_history_pid_ts")
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_price_history_pid_ts_id
+                     ON price_history(product_id, timestamp DESC, id DESC)''')
+
+def analyze_database():
+    """Refreshes SQLite's table statistics so the query planner keeps using the indexes."""
+    get_conn().execute("ANALYZE")
 
 def add_product(url, threshold, name=None):
     """Adds a new product to the database."""
-    with sqlite3.connect(DATABASE) as conn:
-        c = conn.cursor()
-        try:
-            c.execute("INSERT INTO products (url, name, threshold) VALUES (?, ?, ?)", 
-                     (url, name, threshold))
-            conn.commit()
-            print(f"Product added: {name or url}")
-        except sqlite3.IntegrityError:
-            print("Product with this URL already exists in the database.")
-
-def save_price(product_id, price):
-    """Saves a new price entry for a product."""
-    with sqlite3.connect(DATABASE) as conn:
-        c = conn.cursor()
-        c.execute("INSERT INTO price_history (product_id, price) VALUES (?, ?)",
-                 (product_id, price))
-        conn.commit()
+    conn = get_conn()
+    try:
+        with conn:
+            conn.execute(_INSERT_PRODUCT_STMT, (url, name, threshold))
+        print(f"Product added: {name or url}")
+    except sqlite3.IntegrityError:
+        print("Product with this URL already exists in the database.")
+
+def save_prices(conn, rows):
+    """
+    Saves (product_id, price) entries in a single executemany.
+    The caller owns the transaction, so a whole run is committed once.
+    """
+    conn.executemany(_INSERT_PRICE_STMT, rows)
+
+def save_validators(conn, rows):
+    """Stores (etag, last_modified, product_id) cache validators for conditional GETs."""
+    conn.executemany(_UPDATE_VALIDATORS_STMT, rows)
+
+def save_price(conn, product_id, price):
+    """Saves a new price entry for a single product."""
+    save_prices(conn, [(product_id, price)])
 
 # --- Web Scraping Functions ---
 
+_PRICE_RE = re.compile(r'[\d,]+\.?\d*')
+# Thousands separators, dropped in one pass. Whitespace stays: it separates numbers.
+_STRIP_TABLE = str.maketrans('', '', ',')
+
 def parse_price(price_text):
     """
     FIX: Robustly parses price from text.
     Handles currency symbols, commas, and converts to float.
     Replaces the fragile .isdigit() check.
+
+    >>> parse_price('₹1,299')
+    1299.0
+    >>> parse_price('₹1,299₹1,499')
+    1299.0
+    >>> parse_price('₹1,299 ₹1,499')
+    1299.0
+    >>> parse_price('₹ 1,299\\n₹1,499')
+    1299.0
     """
     if price_text is None:
         return None
+    # Fast path: text like "₹1,299" is all digits once the leading symbol and
+    # commas go. Anything else inside the number means the regex may stop early.
+    cleaned = price_text.strip().lstrip('₹').lstrip().translate(_STRIP_TABLE)
+    if cleaned.isdecimal():
+        return float(cleaned)
     # Use regex to find numbers (including decimals) and remove commas
-    price_search = re.search(r'[\d,]+\.?\d*', price_text)
+    price_search = _PRICE_RE.search(price_text)
     if price_search:
-        price_str = price_search.group(0).replace(',', '')
+        price_str = price_search.group(0).translate(_STRIP_TABLE)
         try:
             return float(price_str)
         except (ValueError, TypeError):
             return None
     return None
 
-def get_scraped_price(url):
-    """Determines which scraper to use based on the URL's domain."""
-    domain = url.split("//")[-1].split("/")[0]
-    
-    # Define selectors for each supported site. This makes it easier to update.
-    site_selectors = {
-        'amazon': [
-            'span.a-price-whole', 
-            '#priceblock_ourprice', 
-            '#priceblock_dealprice',
-            'span.priceToPay>span.a-offscreen' # More modern selector
-        ],
-        'flipkart': [
-            'div._30jeq3._16Jk6d', 
-            'div._30jeq3._1_WHN1'
-        ]
-    }
+# Define selectors for each supported site. This makes it easier to update.
+_SITE_SELECTORS = {
+    'amazon': (
+        'span.a-price-whole', 
+        '#priceblock_ourprice', 
+        '#priceblock_dealprice',
+        'span.priceToPay>span.a-offscreen' # More modern selector
+    ),
+    'flipkart': (
+        'div._30jeq3._16Jk6d', 
+        'div._30jeq3._1_WHN1'
+    )
+}
+_CHUNK_SIZE = 64 * 1024
+# Failures of the plain-HTTP paths that should move on to the next fallback
+_REQUEST_ERRORS = (httpx.HTTPError, httpx.InvalidURL)
+# Returned instead of a price when the server answers 304 Not Modified
+NOT_MODIFIED = object()
+_CSS_TRANSLATOR = HTMLTranslator()
+# XPath axis that leads from an element to the left side of each CSS combinator
+_COMBINATOR_AXES = {
+    '>': 'parent::*',
+    ' ': 'ancestor::*',
+    '+': 'preceding-sibling::*[1]',
+    '~': 'preceding-sibling::*',
+}
+_ASIN_RE = re.compile(r'/(?:dp|gp/product|gp/aw/d)/([A-Z0-9]{10})')
+_DOMAIN_RE = re.compile(r'(?:https?://)?([^/]*)')
+_SITE_RE = re.compile('|'.join(_SITE_SELECTORS))
 
-    scraper_to_use = None
-    selectors = []
+def cache_prices(ttl, maxsize=4096):
+    """
+    Memoizes an async scraper's prices per URL within ttl-second time
+    buckets. Only real prices are kept, so failures are retried on the
+    next call. The wrapper exposes cache_clear() for tests.
+    """
+    def decorator(func):
+        bucket, prices = None, {}
 
-    if 'amazon' in domain:
-        scraper_to_use = scrape_website
-        selectors = site_selectors['amazon']
-    elif 'flipkart' in domain:
-        scraper_to_use = scrape_website
-        selectors = site_selectors['flipkart']
-    else:
+        @functools.wraps(func)
+        async def wrapper(client, url, *args, **kwargs):
+            nonlocal bucket
+            current_bucket = int(time.time() // ttl)
+            if current_bucket != bucket:
+                bucket = current_bucket
+                prices.clear()
+            if url in prices:
+                print(f"Using price scraped in the last {ttl} seconds: {prices[url]}")
+                return prices[url]
+            price = await func(client, url, *args, **kwargs)
+            if isinstance(price, float) and len(prices) < maxsize:
+                prices[url] = price
+            return price
+
+        wrapper.cache_clear = prices.clear
+        return wrapper
+    return decorator
+
+@functools.lru_cache(maxsize=1024)
+def resolve_site(url):
+    """
+    Maps a URL to (domain, site), with site set to None for unsupported
+    sites. Cached per URL so scheduled runs skip the hostname parsing and
+    matching.
+    """
+    domain = _DOMAIN_RE.match(url).group(1)
+    site = _SITE_RE.search(domain)
+    return domain, site.group(0) if site else None
+
+@cache_prices(ttl=PRICE_CACHE_TTL)
+async def get_scraped_price(client, url, validators=None):
+    """
+    Determines which scraper to use based on the URL's domain.
+    validators is an optional dict of 'etag'/'last_modified' for a
+    conditional GET; it is updated in place from the response.
+    """
+    domain, site = resolve_site(url)
+    if site is None:
         print(f"Unsupported website: {domain}")
         return None
 
-    return scraper_to_use(url, selectors)
+    return await scrape_website(client, url, site, {} if validators is None else validators)
 
-def scrape_website(url, selectors):
+def _selector_predicate(selector):
+    """Translates a parsed CSS selector into an XPath test on the context element."""
+    if isinstance(selector, CombinedSelector):
+        return (f"{_selector_predicate(selector.subselector)} and "
+                f"{_COMBINATOR_AXES[selector.combinator]}[{_selector_predicate(selector.selector)}]")
+    expr = _CSS_TRANSLATOR.xpath(selector)
+    return f"self::{expr.element}[{expr.condition}]" if expr.condition else f"self::{expr.element}"
+
+def compile_selectors(selectors):
     """
-    Generic scraping function for any website.
-    Tries with requests/BeautifulSoup first, then falls back to Selenium.
+    Compiles CSS selectors into one XPath that tests a single element, so
+    streamed elements can be checked as soon as their end tag is parsed.
     """
-    # 1. Try with requests/BeautifulSoup (fast method)
-    try:
-        response = requests.get(url, headers=HEADERS, timeout=10)
-        response.raise_for_status()  # Raise an exception for bad status codes
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        for selector in selectors:
-            price_element = soup.select_one(selector)
-            if price_element:
-                price = parse_price(price_element.get_text())
-                if price:
-                    print(f"Successfully scraped price (fast method): {price}")
-                    return price
+    predicates = [_selector_predicate(parsed.parsed_tree)
+                  for selector in selectors for parsed in css_parse(selector)]
+    return etree.XPath("boolean(" + " or ".join(f"({p})" for p in predicates) + ")")
 
-    except requests.exceptions.RequestException as e:
-        print(f"Requests failed: {e}. Trying with Selenium.")
+# Compiled once at import so scraping never re-translates CSS to XPath
+_SITE_MATCHERS = {site: compile_selectors(selectors) for site, selectors in _SITE_SELECTORS.items()}
+
+def _match_price(parser, matcher):
+    """Checks the elements the parser finished since the last call for a price."""
+    for _, element in parser.read_events():
+        if matcher(element):
+            price = parse_price(''.join(element.itertext()))
+            if price:
+                return price
+    return None
 
-    # 2. Fallback to Selenium (slower, for dynamic content)
+async def fetch_price(client, url, matcher, validators, base_headers=HEADERS):
+    """
+    Streams the page with httpx and looks for the price in the static HTML,
+    stopping the download as soon as an element accepted by matcher (from
+    compile_selectors) has been parsed.
+    Sends validators as a conditional GET and returns NOT_MODIFIED on a 304.
+    validators is refreshed from the response headers only when the price
+    was read from that response, so a later 304 never vouches for a price
+    that came from somewhere else.
+    """
+    headers = dict(base_headers)
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    
+    parser = etree.HTMLPullParser(events=('end',))
+    async with client.stream('GET', url, headers=headers) as response:
+        if response.status_code == 304:
+            print("Page not modified since the last check.")
+            return NOT_MODIFIED
+        response.raise_for_status()  # Raise an exception for bad status codes
+        response_validators = {'etag': response.headers.get('ETag'),
+                               'last_modified': response.headers.get('Last-Modified')}
+        async for chunk in response.aiter_bytes(_CHUNK_SIZE):
+            parser.feed(chunk)
+            price = _match_price(parser, matcher)
+            if price:
+                validators.update(response_validators)
+                print(f"Successfully scraped price (fast method): {price}")
+                return price
     try:
+        parser.close()
+    except etree.XMLSyntaxError:
+        # Empty or unparseable body; let the Selenium fallback handle it
+        return None
+    
+    price = _match_price(parser, matcher)
+    if price:
+        validators.update(response_validators)
+        print(f"Successfully scraped price (fast method): {price}")
+    return price
+
+def amazon_mobile_url(url):
+    """Returns the mobile product page (/gp/aw/d/<ASIN>) for an Amazon URL, if it names an ASIN."""
+    asin = _ASIN_RE.search(url)
+    if asin is None:
+        return None
+    domain, _ = resolve_site(url)
+    return f"https://{domain}/gp/aw/d/{asin.group(1)}"
+
+# Lighter server-rendered pages to try before starting a browser, per site
+_MOBILE_URL_BUILDERS = {
+    'amazon': amazon_mobile_url,
+}
+
+class DriverPool:
+    """
+    Keeps one headless Chrome per Selenium worker thread, so browser startup
+    is paid once per thread instead of once per URL. When grid_url is set,
+    the browsers are remote sessions on a Selenium Grid.
+    """
+
+    def __init__(self, grid_url=None):
+        self.grid_url = grid_url
+        self._local = threading.local()
+        self._drivers = []
+        self._lock = threading.Lock()
+
+    def _start_driver(self):
         chrome_options = Options()
         chrome_options.add_argument("--headless")
         chrome_options.add_argument(f"user-agent={HEADERS['User-Agent']}")
         
-        # IMPORTANT: Ensure chromedriver is in your PATH or specify its location:
+        if self.grid_url:
+            return webdriver.Remote(command_executor=self.grid_url, options=chrome_options)
+        
+        # Selenium Manager (Selenium 4.6+) locates or downloads a matching
+        # chromedriver automatically. To pin a specific binary instead:
         # from selenium.webdriver.chrome.service import Service
         # service = Service(executable_path='/path/to/your/chromedriver')
-        # driver = webdriver.Chrome(service=service, options=chrome_options)
-        driver = webdriver.Chrome(options=chrome_options)
-        
-        driver.get(url)
+        # return webdriver.Chrome(service=service, options=chrome_options)
+        return webdriver.Chrome(options=chrome_options)
+
+    def get(self):
+        """Returns the calling thread's driver, starting it on first use."""
+        driver = getattr(self._local, 'driver', None)
+        if driver is None:
+            driver = self._start_driver()
+            self._local.driver = driver
+            with self._lock:
+                self._drivers.append(driver)
+        return driver
+
+    def discard(self):
+        """Quits the calling thread's driver so the next get() starts afresh."""
+        driver = getattr(self._local, 'driver', None)
+        if driver is None:
+            return
+        self._local.driver = None
+        with self._lock:
+            self._drivers.remove(driver)
+        self._quit(driver)
+
+    def quit_all(self):
+        """Quits every driver the pool has started."""
+        with self._lock:
+            drivers, self._drivers = self._drivers, []
+        for driver in drivers:
+            self._quit(driver)
+
+    @staticmethod
+    def _quit(driver):
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass
+
+DRIVER_POOL = DriverPool(SELENIUM_GRID_URL)
+atexit.register(DRIVER_POOL.quit_all)
+
+# Raised while starting a browser: a missing local driver comes up as a
+# WebDriverException, an unreachable Grid as a urllib3 connection error
+_DRIVER_START_ERRORS = (WebDriverException, Urllib3HTTPError, OSError)
+
+# Selenium fallbacks run here; its size caps how many browsers are open at once
+_SELENIUM_EXECUTOR = ThreadPoolExecutor(max_workers=MAX_BROWSERS, thread_name_prefix='selenium')
+
+def selenium_fetch(url, selectors):
+    """Loads the page in headless Chrome for prices rendered by JavaScript."""
+    try:
+        driver = DRIVER_POOL.get()
+    except _DRIVER_START_ERRORS as e:
+        print("ERROR: WebDriver setup failed. Ensure Chrome and chromedriver are installed, "
+              "or that the Selenium Grid is reachable.")
+        print(f"Details: {e}")
+        return None
+
+    try:
+        try:
+            driver.get(url)
+        except InvalidSessionIdException:
+            # The Grid ends idle sessions between scheduled runs; retry once on a fresh one
+            DRIVER_POOL.discard()
+            driver = DRIVER_POOL.get()
+            driver.get(url)
         
         for selector in selectors:
             try:
@@ -179,50 +468,128 @@ def scrape_website(url, selectors):
                 # This is expected if a selector doesn't match, just try the next one
                 continue 
                 
-    except WebDriverException as e:
-        print(f"ERROR: WebDriver setup failed. Ensure chromedriver is installed and in your PATH.")
-        print(f"Details: {e}")
-        return None
     except Exception as e:
         print(f"An unexpected error occurred during Selenium scraping: {e}")
+        # The browser may be in a bad state; don't hand it to the next URL
+        DRIVER_POOL.discard()
         return None
-    finally:
-        if 'driver' in locals():
-            driver.quit()
             
     print("Scraping failed. Could not find price on the page.")
     return None
 
+async def scrape_website(client, url, site, validators):
+    """
+    Generic scraping function for any website.
+    Streams the page with httpx/lxml first, then the site's server-rendered
+    mobile page if it has one, and only then falls back to Selenium on a
+    worker thread so a slow browser doesn't block the event loop.
+    """
+    # 1. Try with httpx/lxml (fast method)
+    try:
+        price = await fetch_price(client, url, _SITE_MATCHERS[site], validators)
+        if price:
+            return price
+    except _REQUEST_ERRORS as e:
+        print(f"Request failed: {str(e) or type(e).__name__}")
+    
+    # Any price from here on didn't come from the page the validators
+    # describe, so drop them and make the next run do a full fetch
+    validators.update(etag=None, last_modified=None)
+
+    # 2. Try the mobile page, which carries the price without JavaScript
+    mobile_url = _MOBILE_URL_BUILDERS[site](url) if site in _MOBILE_URL_BUILDERS else None
+    if mobile_url:
+        print(f"Trying the mobile page: {mobile_url}")
+        try:
+            # The validators belong to the desktop page, so don't send or update them
+            price = await fetch_price(client, mobile_url, _SITE_MATCHERS[site], {}, MOBILE_HEADERS)
+            if price:
+                return price
+        except _REQUEST_ERRORS as e:
+            print(f"Mobile page request failed: {str(e) or type(e).__name__}")
+
+    # 3. Fallback to Selenium (slowest, for dynamic or captcha-gated pages)
+    print("Trying with Selenium.")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_SELENIUM_EXECUTOR, selenium_fetch, url, _SITE_SELECTORS[site])
+
+def run_event_loop(coro):
+    """Runs coro to completion on uvloop when it is installed, else on asyncio's loop."""
+    if uvloop is not None:
+        return uvloop.run(coro)
+    return asyncio.run(coro)
+
+async def _scrape_or_none(client, url, validators):
+    """Scrapes one product, turning unexpected errors into None so they can't abort the batch."""
+    try:
+        return await get_scraped_price(client, url, validators)
+    except Exception as e:
+        print(f"An unexpected error occurred while scraping {url}: {e!r}")
+        # Whatever state the validators were left in can't be trusted
+        validators.update(etag=None, last_modified=None)
+        return None
+
+async def scrape_prices(targets):
+    """
+    Scrapes (url, validators) pairs concurrently over one pooled client,
+    returning the prices in input order.
+    """
+    # Over HTTP/2 every product on a store multiplexes onto one connection,
+    # so each host costs a single DNS lookup and TLS handshake per run, and
+    # a stream cut short after the price is found doesn't drop the connection.
+    # That leaves nothing for a separate DNS cache to save.
+    async with httpx.AsyncClient(
+        http2=True,
+        headers=HEADERS,
+        timeout=10,
+        follow_redirects=True,
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=30),
+    ) as client:
+        return await asyncio.gather(*(_scrape_or_none(client, url, validators)
+                                      for url, validators in targets))
+
 
 # --- Core Logic & Email ---
 
 def check_price_drop():
     """
-    Main job function: iterates through products, gets current price,
-    and sends an alert if the price drops below the threshold.
+    Main job function: scrapes all products concurrently, records the prices
+    in one batch, then sends an alert for each product whose price dropped
+    below its threshold. Unchanged pages (HTTP 304) reuse the last price.
     """
-    with sqlite3.connect(DATABASE) as conn:
-        products = pd.read_sql_query("SELECT * FROM products", conn)
+    conn = get_conn()
+    with conn:
+        products = conn.execute(_SELECT_PRODUCTS_STMT).fetchall()
+        
+        # Latest recorded price per product, from before this run, in one query
+        previous_prices = dict(conn.execute(_SELECT_LATEST_PRICES_STMT).fetchall())
         
-        for _, product in products.iterrows():
-            print(f"\nChecking price for: {product['name']} ({product['url']})")
-            current_price = get_scraped_price(product['url'])
+        # Only revalidate pages that already have a price a 304 could reuse
+        validators = [
+            {'etag': product['etag'], 'last_modified': product['last_modified']}
+            if product['id'] in previous_prices else {}
+            for product in products
+        ]
+        prices = run_event_loop(scrape_prices(zip((product['url'] for product in products), validators)))
+        
+        results = []
+        for product, price in zip(products, prices):
+            if price is NOT_MODIFIED:
+                price = previous_prices[product['id']]
+            results.append((product, price))
+        save_prices(conn, [(product['id'], price) for product, price in results if price is not None])
+        save_validators(conn, [(v.get('etag'), v.get('last_modified'), product['id'])
+                               for (product, _), v in zip(results, validators)])
+        
+        for product, current_price in results:
+            print(f"\nChecked price for: {product['name']} ({product['url']})")
             
             if current_price is None:
                 print("Could not retrieve price. Skipping.")
                 continue
-                
-            save_price(product['id'], current_price)
             
-            # Use parameterized query for safety and clarity
-            history = pd.read_sql_query(
-                "SELECT price FROM price_history WHERE product_id = ? ORDER BY timestamp DESC LIMIT 2",
-                conn,
-                params=(product['id'],)
-            )
-            
-            if len(history) > 1:
-                previous_price = history.iloc[1]['price']
+            previous_price = previous_prices.get(product['id'])
+            if previous_price is not None:
                 if current_price < previous_price:
                     print(f"PRICE DROP DETECTED for {product['name']}: ₹{previous_price} → ₹{current_price}")
                     
@@ -270,24 +637,34 @@ def send_alert(product, current_price, previous_price):
     except Exception as e:
         print(f"Failed to send email: {e}")
 
+def format_history(history):
+    """Lays out (price, timestamp) rows as a numbered, right-aligned table."""
+    rows = [('', 'price', 'timestamp')] + [(str(i), str(price), str(timestamp))
+                                           for i, (price, timestamp) in enumerate(history)]
+    widths = [max(len(row[col]) for row in rows) for col in range(3)]
+    return '\n'.join(f"{index:<{widths[0]}}  {price:>{widths[1]}}  {timestamp:>{widths[2]}}"
+                     for index, price, timestamp in rows)
+
 def generate_price_report():
     """Generates and prints a price history report for all products."""
-    with sqlite3.connect(DATABASE) as conn:
-        products = pd.read_sql_query("SELECT * FROM products", conn)
+    conn = get_conn()
+    with conn:
+        products = conn.execute(_SELECT_PRODUCTS_STMT).fetchall()
+        
+        # Fetch all history at once and group it by product here
+        history_by_product = {}
+        for product_id, price, timestamp in conn.execute(_SELECT_HISTORY_STMT).fetchall():
+            history_by_product.setdefault(product_id, []).append((price, timestamp))
         
-        for _, product in products.iterrows():
-            history = pd.read_sql_query(
-                "SELECT price, timestamp FROM price_history WHERE product_id = ? ORDER BY timestamp",
-                conn,
-                params=(product['id'],)
-            )
+        for product in products:
+            history = history_by_product.get(product['id'])
             
-            if not history.empty:
+            if history:
                 print(f"\n--- Price History for {product['name']} ---")
-                print(history.to_string())
+                print(format_history(history))
                 
-                initial_price = history.iloc[0]['price']
-                current_price = history.iloc[-1]['price']
+                initial_price = history[0][0]
+                current_price = history[-1][0]
                 change = current_price - initial_price
                 
                 if initial_price > 0:
@@ -300,6 +677,7 @@ def generate_price_report():
 def run_scheduler(interval_hours=6):
     """Schedules the price check job to run at a regular interval."""
     schedule.every(interval_hours).hours.do(check_price_drop)
+    schedule.every().week.do(analyze_database)
     
     print(f"Starting price monitoring. Checking every {interval_hours} hours...")
     while True:
@@ -313,6 +691,8 @@ def main():
     setup_database()
     
     parser = argparse.ArgumentParser(description="E-commerce Price Monitoring Tool")
+    parser.add_argument('--grid-url', default=SELENIUM_GRID_URL,
+                        help='Selenium Grid URL for the browser fallback (default: local Chrome)')
     subparsers = parser.add_subparsers(dest='command', help='Available commands', required=True)
     
     # 'add' command
@@ -332,6 +712,7 @@ def main():
     subparsers.add_parser('report', help='Generate a price history report')
     
     args = parser.parse_args()
+    DRIVER_POOL.grid_url = args.grid_url
     
     if args.command == 'add':
         add_product(args.url, args.threshold, args.name)